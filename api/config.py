@@ -0,0 +1,29 @@
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field
+
+# Load environment variables once for the whole application
+load_dotenv()
+
+class Settings(BaseModel):
+    """Application settings read from environment variables."""
+    thirdweb_secret_key: Optional[str] = Field(None, description="Thirdweb API secret key")
+    google_api_key: Optional[str] = Field(None, description="Google API key (for Gemini)")
+    exa_api_key: Optional[str] = Field(None, description="Exa API key for web search")
+    openai_api_key: Optional[str] = Field(None, description="OpenAI API key (for fallback)")
+    mongodb_uri: Optional[str] = Field(None, description="MongoDB connection string")
+    mongodb_db: str = Field("financial_db", description="MongoDB database name")
+    checkpoint_db: str = Field("state.db", description="SQLite file for persisted graph state")
+
+# Environment variables are read once, when the module is first imported
+settings = Settings(
+    thirdweb_secret_key=os.getenv("THIRDWEB_SECRET_KEY"),
+    google_api_key=os.getenv("GOOGLE_API_KEY"),
+    exa_api_key=os.getenv("EXA_API_KEY"),
+    openai_api_key=os.getenv("OPENAI_API_KEY"),
+    mongodb_uri=os.getenv("MONGODB_URI"),
+    mongodb_db=os.getenv("MONGODB_DB", "financial_db"),
+    checkpoint_db=os.getenv("CHECKPOINT_DB", "state.db"),
+)
@@ -1,12 +1,78 @@
-import os
+import asyncio
 import logging
 import motor.motor_asyncio
 from typing import List, Dict, Any, Optional
-from dotenv import load_dotenv
-from bson import ObjectId
 
-# Load environment variables
-load_dotenv()
+from api.config import settings
+
+# Collections holding per-user documents, all filtered on ``userId``
+USER_COLLECTIONS = ("contacts", "expenses", "products", "transactions")
+
+# Fetch a user's documents in a single batch
+CURSOR_OPTIONS = {"batchSize": 5000}
+
+
+def _users_pipeline(user_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Build an aggregation pipeline matching the documents of several users.
+    
+    The ``_id`` field is converted to a string on the server so documents
+    are JSON serializable without a client-side pass over the results.
+    """
+    return [
+        {"$match": {"userId": {"$in": user_ids}}},
+        {"$addFields": {"_id": {"$toString": "$_id"}}},
+    ]
+
+
+class UserReadBatcher:
+    """
+    Coalesces concurrent per-user reads of a collection into a single query.
+    
+    Reads enqueued within ``delay`` seconds of each other are merged into one
+    ``userId: {"$in": [...]}`` query, and the results are split back per user.
+    """
+    
+    def __init__(self, collection, delay: float = 0.001):
+        self.collection = collection
+        self.delay = delay
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    async def enqueue(self, user_id: str) -> List[Dict[str, Any]]:
+        """Queue a read for a user and wait for the batched result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(user_id, []).append(future)
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        return await future
+    
+    async def _flush(self):
+        """Run one query for every pending user and resolve their futures."""
+        await asyncio.sleep(self.delay)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        
+        try:
+            cursor = self.collection.aggregate(_users_pipeline(list(pending)), **CURSOR_OPTIONS)
+            docs = await cursor.to_list(length=None)
+            
+            grouped: Dict[str, List[Dict[str, Any]]] = {user_id: [] for user_id in pending}
+            for doc in docs:
+                grouped[doc["userId"]].append(doc)
+            
+            for user_id, futures in pending.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(list(grouped[user_id]))
+        except Exception as e:
+            # Fail every unresolved read so no caller waits forever
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
 
 class MongoDB:
     """MongoDB connection and utility functions for the financial database."""
@@ -14,35 +80,72 @@ class MongoDB:
     # Class variables for connection
     client = None
     db = None
+    batchers: Dict[str, UserReadBatcher] = {}
+    _connect_lock: Optional[asyncio.Lock] = None
     
     @classmethod
     async def connect(cls):
         """
         Establish a connection to MongoDB.
         Uses the MONGODB_URI environment variable for connection.
+        Called once at application startup; the client's connection pool
+        is shared by all requests.
         """
         try:
-            mongodb_uri = os.getenv("MONGODB_URI")
+            mongodb_uri = settings.mongodb_uri
             if not mongodb_uri:
                 logging.error("MONGODB_URI environment variable not set")
                 return False
             
-            # Create a new client and connect to the server
-            cls.client = motor.motor_asyncio.AsyncIOMotorClient(mongodb_uri)
+            # Create a new pooled client and connect to the server
+            cls.client = motor.motor_asyncio.AsyncIOMotorClient(
+                mongodb_uri,
+                maxPoolSize=100,
+                minPoolSize=10,
+                maxIdleTimeMS=30000,
+            )
             # Select the database
-            db_name = os.getenv("MONGODB_DB", "financial_db")
+            db_name = settings.mongodb_db
             cls.db = cls.client[db_name]
             
             # Ping the database to verify connection
             await cls.client.admin.command("ping")
+            
+            # Ensure the userId index used by every per-user query exists. Queries don't hint
+            # it and still work without it (e.g. for a read-only user), so a failure isn't fatal
+            try:
+                await asyncio.gather(
+                    *[cls.db[name].create_index("userId") for name in USER_COLLECTIONS]
+                )
+            except Exception as e:
+                logging.warning(f"Could not create userId indexes: {str(e)}")
+            cls.batchers = {name: UserReadBatcher(cls.db[name]) for name in USER_COLLECTIONS}
             logging.info(f"Successfully connected to MongoDB database: {db_name}")
             return True
         except Exception as e:
             logging.error(f"MongoDB connection error: {str(e)}")
+            # Close the failed client so its pooled connections aren't leaked
+            if cls.client:
+                cls.client.close()
             cls.client = None
             cls.db = None
+            cls.batchers = {}
             return False
     
+    @classmethod
+    async def ensure_connected(cls) -> bool:
+        """
+        Connect on first use if the application hasn't connected yet.
+        Concurrent callers share a single connection attempt.
+        """
+        # The batchers are only set once the connection is fully established
+        if cls.batchers:
+            return True
+        if cls._connect_lock is None:
+            cls._connect_lock = asyncio.Lock()
+        async with cls._connect_lock:
+            return bool(cls.batchers) or await cls.connect()
+    
     @classmethod
     async def close(cls):
         """Close the MongoDB connection."""
@@ -50,120 +153,93 @@ class MongoDB:
             cls.client.close()
             cls.client = None
             cls.db = None
+            cls.batchers = {}
             logging.info("MongoDB connection closed")
     
     @classmethod
-    async def get_contacts(cls, user_id: str) -> List[Dict[str, Any]]:
+    async def _get_by_user(cls, collection: str, user_id: str) -> List[Dict[str, Any]]:
         """
-        Get all contacts for a user.
+        Get all documents in a collection for a user.
+        Concurrent reads for the same collection are batched into one query.
         
         Args:
-            user_id: The user ID to get contacts for
+            collection: Name of the collection to query
+            user_id: The user ID to filter documents by
             
         Returns:
-            List of contact documents
+            List of documents, or an empty list on error
         """
         try:
-            if not cls.db:
-                await cls.connect()
-            
-            # Use user_id to filter contacts
-            cursor = cls.db.contacts.find({"userId": user_id})
-            contacts = await cursor.to_list(length=None)
-            
-            # Convert ObjectId to string for JSON serialization
-            for contact in contacts:
-                if "_id" in contact and isinstance(contact["_id"], ObjectId):
-                    contact["_id"] = str(contact["_id"])
-            
-            return contacts
+            return await cls.batchers[collection].enqueue(user_id)
         except Exception as e:
-            logging.error(f"Error retrieving contacts: {str(e)}")
+            logging.error(f"Error retrieving {collection}: {str(e)}")
             return []
     
+    @classmethod
+    async def get_contacts(cls, user_id: str) -> List[Dict[str, Any]]:
+        """Get all contacts for a user."""
+        return await cls._get_by_user("contacts", user_id)
+    
     @classmethod
     async def get_expenses(cls, user_id: str) -> List[Dict[str, Any]]:
-        """
-        Get all expenses for a user.
-        
-        Args:
-            user_id: The user ID to get expenses for
-            
-        Returns:
-            List of expense documents
-        """
-        try:
-            if not cls.db:
-                await cls.connect()
-            
-            # Use user_id to filter expenses
-            cursor = cls.db.expenses.find({"userId": user_id})
-            expenses = await cursor.to_list(length=None)
-            
-            # Convert ObjectId to string for JSON serialization
-            for expense in expenses:
-                if "_id" in expense and isinstance(expense["_id"], ObjectId):
-                    expense["_id"] = str(expense["_id"])
-            
-            return expenses
-        except Exception as e:
-            logging.error(f"Error retrieving expenses: {str(e)}")
-            return []
+        """Get all expenses for a user."""
+        return await cls._get_by_user("expenses", user_id)
     
     @classmethod
     async def get_products(cls, user_id: str) -> List[Dict[str, Any]]:
+        """Get all products for a user."""
+        return await cls._get_by_user("products", user_id)
+    
+    @classmethod
+    async def get_transactions(cls, user_id: str) -> List[Dict[str, Any]]:
+        """Get all transactions for a user."""
+        return await cls._get_by_user("transactions", user_id)
+    
+    @classmethod
+    async def aggregate_expenses(cls, user_id: str) -> List[Dict[str, Any]]:
         """
-        Get all products for a user.
+        Get a user's expense totals per category, largest first.
+        
+        The totals are computed on the server, so only one document per
+        category is sent back instead of every expense.
         
         Args:
-            user_id: The user ID to get products for
+            user_id: The user ID to aggregate expenses for
             
         Returns:
-            List of product documents
+            List of ``{"_id": category, "total": ..., "count": ...}`` documents,
+            or an empty list on error
         """
+        pipeline = [
+            {"$match": {"userId": user_id}},
+            {"$group": {
+                "_id": {"$ifNull": ["$category", "Uncategorized"]},
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"total": -1}},
+        ]
         try:
-            if not cls.db:
-                await cls.connect()
-            
-            # Use user_id to filter products
-            cursor = cls.db.products.find({"userId": user_id})
-            products = await cursor.to_list(length=None)
-            
-            # Convert ObjectId to string for JSON serialization
-            for product in products:
-                if "_id" in product and isinstance(product["_id"], ObjectId):
-                    product["_id"] = str(product["_id"])
-            
-            return products
+            cursor = cls.db.expenses.aggregate(pipeline)
+            return await cursor.to_list(length=None)
         except Exception as e:
-            logging.error(f"Error retrieving products: {str(e)}")
+            logging.error(f"Error aggregating expenses: {str(e)}")
             return []
     
     @classmethod
-    async def get_transactions(cls, user_id: str) -> List[Dict[str, Any]]:
+    async def get_all_user_data(cls, user_id: str) -> Dict[str, List[Dict[str, Any]]]:
         """
-        Get all transactions for a user.
+        Get contacts, expenses, products and transactions for a user.
+        
+        The four collections are independent, so they are queried concurrently.
         
         Args:
-            user_id: The user ID to get transactions for
+            user_id: The user ID to get data for
             
         Returns:
-            List of transaction documents
+            Dictionary mapping each collection name to its list of documents
         """
-        try:
-            if not cls.db:
-                await cls.connect()
-            
-            # Use user_id to filter transactions
-            cursor = cls.db.transactions.find({"userId": user_id})
-            transactions = await cursor.to_list(length=None)
-            
-            # Convert ObjectId to string for JSON serialization
-            for transaction in transactions:
-                if "_id" in transaction and isinstance(transaction["_id"], ObjectId):
-                    transaction["_id"] = str(transaction["_id"])
-            
-            return transactions
-        except Exception as e:
-            logging.error(f"Error retrieving transactions: {str(e)}")
-            return [] 
\ No newline at end of file
+        results = await asyncio.gather(
+            *[cls._get_by_user(name, user_id) for name in USER_COLLECTIONS]
+        )
+        return dict(zip(USER_COLLECTIONS, results))
@@ -1,26 +1,34 @@
 from typing import Callable, Dict, Any
 from functools import lru_cache
-from dotenv import load_dotenv
-import os
 
 from langchain_core.caches import InMemoryCache
 from langchain_core.globals import set_llm_cache
 
+from api.config import settings
 from src.graph import build_graph
 
-# Load environment variables
-load_dotenv()
-
 # Set up LLM cache
 set_llm_cache(InMemoryCache())
 
+# Checkpointer used to persist graph state; set at application startup
+_checkpointer = None
+
+def configure_checkpointer(checkpointer) -> None:
+    """
+    Sets the checkpointer used by the graph returned from get_graph.
+    Clears any previously built graph so the next call uses the new checkpointer.
+    """
+    global _checkpointer
+    _checkpointer = checkpointer
+    get_graph.cache_clear()
+
 @lru_cache()
 def get_graph():
     """
     Returns a cached instance of the LangGraph.
     Uses lru_cache to ensure only one instance is created.
     """
-    return build_graph()
+    return build_graph(checkpointer=_checkpointer)
 
 def get_config() -> Dict[str, Dict[str, Any]]:
     """
@@ -28,16 +36,17 @@ def get_config() -> Dict[str, Dict[str, Any]]:
     """
     return {"configurable": {"thread_id": "1"}}
 
+# API key statuses, read once at import since the environment does not change at runtime
+_API_KEY_STATUS = {
+    "thirdweb": settings.thirdweb_secret_key is not None,
+    "google": settings.google_api_key is not None,
+    "exa": settings.exa_api_key is not None,
+    "openai": settings.openai_api_key is not None,
+}
+
 def check_api_keys() -> Dict[str, bool]:
     """
     Checks if necessary API keys are set in environment variables.
-    Returns a dictionary with API statuses.
-    """
-    keys = {
-        "thirdweb": os.getenv("THIRDWEB_SECRET_KEY") is not None,
-        "google": os.getenv("GOOGLE_API_KEY") is not None,
-        "exa": os.getenv("EXA_API_KEY") is not None,
-        "openai": os.getenv("OPENAI_API_KEY") is not None,
-    }
-    
-    return keys 
\ No newline at end of file
+    Returns a dictionary with API statuses; callers must not mutate it.
+    """
+    return _API_KEY_STATUS
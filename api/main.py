@@ -1,19 +1,51 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+import orjson
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
-import os
+from fastapi.responses import ORJSONResponse
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
-from api.dependencies import get_graph
+from api.config import settings
+from api.database import MongoDB
+from api.dependencies import configure_checkpointer, get_graph
 from api.routers import conversations, health
 
-# Load environment variables
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the shared MongoDB connection pool and the graph state store, and
+    build the graph on startup; close both on shutdown.
+    """
+    await MongoDB.connect()
+    
+    # Persist graph state in SQLite so it is written off the event loop
+    async with AsyncSqliteSaver.from_conn_string(settings.checkpoint_db) as checkpointer:
+        # WAL lets reads proceed during checkpoint writes, and NORMAL skips an fsync per commit
+        await checkpointer.conn.execute("PRAGMA journal_mode=WAL")
+        await checkpointer.conn.execute("PRAGMA synchronous=NORMAL")
+        configure_checkpointer(checkpointer)
+        
+        # Build the graph once so health checks only read the cached outcome
+        try:
+            get_graph()
+            app.state.graph_ok = True
+            app.state.graph_err = None
+        except Exception as e:
+            app.state.graph_ok = False
+            app.state.graph_err = str(e)
+        
+        yield
+    
+    await MongoDB.close()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Thirdweb AI LangGraph API",
     description="RESTful API for blockchain AI assistant using LangGraph",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -29,11 +61,14 @@ app.add_middleware(
 app.include_router(conversations.router, prefix="/api", tags=["Conversations"])
 app.include_router(health.router, prefix="/api", tags=["Health"])
 
+# The root payload never changes, so it is serialized once at import
+_ROOT_BODY = orjson.dumps({
+    "message": "Welcome to Thirdweb AI LangGraph API",
+    "docs": "/docs",
+    "health": "/api/health"
+})
+
 @app.get("/", tags=["Root"])
 async def root():
     """Root endpoint that returns API information."""
-    return {
-        "message": "Welcome to Thirdweb AI LangGraph API",
-        "docs": "/docs",
-        "health": "/api/health"
-    } 
\ No newline at end of file
+    return Response(content=_ROOT_BODY, media_type="application/json")
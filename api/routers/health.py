@@ -1,40 +1,58 @@
-from fastapi import APIRouter, Depends
-from typing import Dict
+from fastapi import APIRouter, Depends, Request, Response
+from typing import Dict, Tuple
+from datetime import datetime
+import orjson
 
 from api.models import HealthCheckResponse
-from api.dependencies import check_api_keys, get_graph
+from api.dependencies import check_api_keys
 
 router = APIRouter()
 
+# Serialized health payloads (without the timestamp) keyed by the inputs they depend on
+_HEALTH_BODIES: Dict[Tuple, bytes] = {}
+
+def _health_body(api_keys: Dict[str, bool], graph_ok: bool, graph_err: str) -> bytes:
+    """
+    Returns the serialized health payload up to the timestamp field.
+    The payload only changes with the API keys and graph status, so it is
+    built once per combination.
+    """
+    key = (tuple(api_keys.items()), graph_ok, graph_err)
+    body = _HEALTH_BODIES.get(key)
+    if body is None:
+        # Determine overall status
+        status = "healthy"
+        graph_status = "available"
+        
+        # Check if any key is missing
+        if not all(api_keys.values()):
+            status = "degraded"
+        
+        # The graph is built at startup; report the cached outcome
+        if not graph_ok:
+            status = "degraded"
+            graph_status = f"unavailable: {graph_err or 'not initialized'}"
+        
+        payload = orjson.dumps({"status": status, "api_keys": api_keys, "graph": graph_status})
+        # Leave the object open so the timestamp can be appended per request
+        body = payload[:-1] + b',"timestamp":'
+        _HEALTH_BODIES[key] = body
+    return body
+
 @router.get("/health", response_model=HealthCheckResponse)
 @router.head("/health")
-async def health_check():
+async def health_check(request: Request):
     """
     Check the health status of the service and its dependencies.
     Returns the status of API keys and the LangGraph availability.
     Supports both GET and HEAD requests.
     """
-    # Check API keys
-    api_keys = check_api_keys()
-    
-    # Determine overall status
-    status = "healthy"
-    graph_status = "available"
-    
-    # Check if any key is missing
-    if not all(api_keys.values()):
-        status = "degraded"
-    
-    # Try to initialize graph to check if it's working
-    try:
-        # Just initialize the graph (won't run it)
-        get_graph()
-    except Exception as e:
-        status = "degraded"
-        graph_status = f"unavailable: {str(e)}"
-    
-    return HealthCheckResponse(
-        status=status,
-        api_keys=api_keys,
-        graph=graph_status
-    ) 
\ No newline at end of file
+    body = _health_body(
+        check_api_keys(),
+        getattr(request.app.state, "graph_ok", False),
+        getattr(request.app.state, "graph_err", None),
+    )
+    return Response(
+        content=body + orjson.dumps(datetime.now()) + b"}",
+        media_type="application/json"
+    )
@@ -25,6 +25,9 @@ class ConversationService:
         Returns:
             Dict containing the response and messages
         """
+        # A single timestamp is shared by every message in this response
+        now = datetime.now()
+        
         try:
             # Format input for the graph
             inputs = {
@@ -36,49 +39,37 @@ class ConversationService:
             # Configure the graph with user thread ID
             config = {"configurable": {"thread_id": user_id}}
             
-            # Process the graph and collect all steps
-            steps = list(graph.stream(inputs, stream_mode="values", config=config))
+            # Stream the graph, keeping only the latest state
+            final_step = None
+            async for step in graph.astream(inputs, stream_mode="values", config=config):
+                final_step = step
             
-            if not steps:
+            if final_step is None:
                 return {
                     "success": False,
                     "error": "No response from AI assistant",
-                    "messages": [{"role": "user", "content": message, "timestamp": datetime.now()}]
+                    "messages": [{"role": "user", "content": message, "timestamp": now}]
                 }
             
-            final_step = steps[-1]
-            
-            # Get the last AI message as the response
+            # Format messages for response, keeping the last AI message as the response
             response = ""
-            if final_step.get("messages"):
-                for msg in reversed(final_step["messages"]):
-                    if isinstance(msg, AIMessage) and hasattr(msg, "content"):
-                        response = msg.content
-                        break
-            
-            # Format messages for response
             formatted_messages = []
-            if final_step.get("messages"):
-                for msg in final_step["messages"]:
-                    if hasattr(msg, "content"):
-                        role = "assistant" if isinstance(msg, AIMessage) else "user"
-                        formatted_messages.append({
-                            "role": role, 
-                            "content": msg.content,
-                            "timestamp": datetime.now()
-                        })
-            
-            # Collect tools used for debugging
-            tools_used = []
-            for step in steps:
-                if step.get("tools_used"):
-                    tools_used.extend(step["tools_used"])
+            for msg in final_step.get("messages") or []:
+                if not hasattr(msg, "content"):
+                    continue
+                is_ai = isinstance(msg, AIMessage)
+                formatted_messages.append({
+                    "role": "assistant" if is_ai else "user",
+                    "content": msg.content,
+                    "timestamp": now
+                })
+                if is_ai:
+                    response = msg.content
             
             return {
                 "success": True,
                 "response": response,
-                "messages": formatted_messages,
-                "tools_used": tools_used
+                "messages": formatted_messages
             }
             
         except Exception as e:
@@ -86,7 +77,7 @@ class ConversationService:
             return {
                 "success": False,
                 "error": f"Error processing message: {str(e)}",
-                "messages": [{"role": "user", "content": message, "timestamp": datetime.now()}]
+                "messages": [{"role": "user", "content": message, "timestamp": now}]
             }
     
     @staticmethod
@@ -1,8 +1,11 @@
+import asyncio
+import io
 import logging
-import json
+import sys
 from typing import Dict, Any, List
 
-from dotenv import load_dotenv
+import orjson
+
 from langchain_core.caches import InMemoryCache
 from langchain_core.globals import set_llm_cache
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
@@ -14,9 +17,9 @@ from rich.text import Text
 from rich.table import Table
 from rich.tree import Tree
 
+import api.config  # Loads environment variables from .env
 from src.graph import build_graph
 
-load_dotenv()
 set_llm_cache(InMemoryCache())
 
 # Configure logging to show warnings - helps with debugging
@@ -25,6 +28,19 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 console = Console()
+# Renders tool displays into memory so each one is written to the terminal at once
+buffered_console = Console(file=io.StringIO(), force_terminal=True, width=console.width)
+
+PROMPT_STYLE = Style(color="green", bold=True)
+
+
+def flush_buffered_console():
+    """Write everything rendered to the buffered console to stdout and reset it."""
+    buffer = buffered_console.file
+    sys.stdout.write(buffer.getvalue())
+    sys.stdout.flush()
+    buffer.seek(0)
+    buffer.truncate(0)
 
 def log_process_step(step_name, details=None):
     """Log a processing step with optional details."""
@@ -64,12 +80,15 @@ def display_tools_used(tools_used: List[Dict[str, Any]]) -> None:
             if key != "tool":
                 # Format lists and dictionaries nicely
                 if isinstance(value, (list, dict)):
-                    formatted_value = json.dumps(value, indent=2)
+                    formatted_value = orjson.dumps(
+                        value, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                    ).decode()
                     tool_node.add(f"[dim]{key}:[/dim] {formatted_value}")
                 else:
                     tool_node.add(f"[dim]{key}:[/dim] {value}")
     
-    console.print(tree)
+    buffered_console.print(tree)
+    flush_buffered_console()
 
 
 def display_processing_log(steps):
@@ -108,10 +127,11 @@ def display_processing_log(steps):
             
         log_table.add_row(f"{i}. {node}", action, result)
     
-    console.print(log_table)
+    buffered_console.print(log_table)
+    flush_buffered_console()
 
 
-def main():
+async def main_async():
     """Runs the interactive agent session."""
     log_process_step("Starting Insight Chat")
     graph = build_graph()
@@ -127,11 +147,19 @@ def main():
     # Just display a welcome prompt
     console.print("I'm an AI assistant specialized in blockchain and web3. Please ask a blockchain-related question!", style="green")
     
+    # Build Rich components once and reuse them for every turn
+    prompt_text = Text("You: ", style=PROMPT_STYLE)
+    progress = Progress(
+        SpinnerColumn(),
+        TextColumn("[progress.description]{task.description}"),
+        TimeElapsedColumn(),
+        console=console,
+        transient=True,
+    )
+    
     while True:
         try:
-            user_input = console.input(
-                Text("You: ", style=Style(color="green", bold=True))
-            )
+            user_input = console.input(prompt_text)
             if user_input.lower() in ("exit", "quit"):
                 console.print("[bold red]Exiting...[/bold red]")
                 break
@@ -152,12 +180,7 @@ def main():
             
             log_process_step("Processing user input", f"Message: '{user_input}'")
 
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                TimeElapsedColumn(),
-                transient=True,
-            ) as progress:
+            with progress:
                 task = progress.add_task("Processing...", total=None)
 
                 config = {"configurable": {"thread_id": "1"}}
@@ -165,8 +188,10 @@ def main():
                 steps = []
                 tool_usage_log = []
                 try:
-                    # Process the graph and collect all steps
-                    steps = list(graph.stream(inputs, stream_mode="values", config=config))
+                    # Stream the graph, updating progress as each step arrives
+                    async for step in graph.astream(inputs, stream_mode="values", config=config):
+                        steps.append(step)
+                        progress.update(task, description=f"Step {len(steps)}")
                     log_process_step("Graph execution completed", f"Steps: {len(steps)}")
                     
                     if steps:
@@ -174,10 +199,8 @@ def main():
                         if step.get("messages") and len(step["messages"]) > 0:
                             message = step["messages"][-1]
                         
-                        # Collect all tools used across all steps
-                        for s in steps:
-                            if "tools_used" in s and s["tools_used"]:
-                                tool_usage_log.extend(s["tools_used"])
+                        # Each step holds the cumulative state, so the final step has every tool used
+                        tool_usage_log = step.get("tools_used") or []
                 except Exception as e:
                     error_msg = f"Error in graph stream: {e}"
                     logging.error(error_msg)
@@ -188,26 +211,27 @@ def main():
                 if steps and steps[-1] and "messages" in steps[-1]:
                     tool_messages = [
                         {
-                            "name": msg.model_dump().get("name", "unknown"),
-                            "status": msg.model_dump().get("status", "unknown"),
+                            "name": getattr(msg, "name", None) or "unknown",
+                            "status": getattr(msg, "status", None) or "unknown",
                         }
                         for msg in steps[-1].get("messages", [])
                         if isinstance(msg, ToolMessage)
                     ]
 
                 progress.remove_task(task)
-                
-                # Display processing log
-                if steps:
-                    display_processing_log(steps)
-
-                # Display tool usage details
-                if tool_usage_log:
-                    display_tools_used(tool_usage_log)
-                elif tool_messages:
-                    console.print("\nTool calls detected:", style="bold yellow")
-                    for tool in tool_messages:
-                        console.print(f"- {tool['name']}: {tool['status']}")
+
+            # Display processing log once the progress display has stopped, so the buffered
+            # output is written straight to the terminal instead of through Rich's stdout proxy
+            if steps:
+                display_processing_log(steps)
+
+            # Display tool usage details
+            if tool_usage_log:
+                display_tools_used(tool_usage_log)
+            elif tool_messages:
+                console.print("\nTool calls detected:", style="bold yellow")
+                for tool in tool_messages:
+                    console.print(f"- {tool['name']}: {tool['status']}")
 
             # Display the final message
             if message:
@@ -228,4 +252,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main_async())
@@ -1,22 +1,23 @@
 import argparse
 import os
+from functools import lru_cache
 
-from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.prebuilt import create_react_agent
-from rich.console import Console
+from rich.console import Console, Group
+from rich.live import Live
 from rich.panel import Panel
-from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+from rich.spinner import Spinner
 from rich.style import Style
 from rich.text import Text
 from thirdweb_ai import Insight, Nebula
 from thirdweb_ai.adapters.langchain import get_langchain_tools
 
+import api.config  # Loads environment variables from .env
 from src.tools import count_json_list, extract_json_value
 
-load_dotenv()
 console = Console()
 
 
@@ -54,8 +55,14 @@ def define_args():
 
 def build_graph(args):
     """Build the Nebula chat agent graph."""
+    return _build_graph_cached(args.model, args.provider, args.temperature, args.chain_id)
 
-    if args.model == "nebula":
+
+@lru_cache(maxsize=8)
+def _build_graph_cached(model_name, provider, temperature, chain_id):
+    """Build the agent graph once per (model, provider, temperature, chain) configuration."""
+
+    if model_name == "nebula":
         model = Nebula(secret_key=os.getenv("THIRDWEB_SECRET_KEY"))
         prompt = (
             "You have acces to Nebula, a language model trained on the blockchain, with access to real-time data. "
@@ -65,9 +72,9 @@ def build_graph(args):
             "If the user's query does not relate to blockchain, you do not have to call this tool. "
             "If you Nebula cannot answer a blockchain question state this; do not attempt to answer it yourself."
         )
-    elif args.model == "insight":
+    elif model_name == "insight":
         model = Insight(
-            secret_key=os.getenv("THIRDWEB_SECRET_KEY"), chain_id=args.chain_id
+            secret_key=os.getenv("THIRDWEB_SECRET_KEY"), chain_id=chain_id
         )
         prompt = (
             "You have access to 'thirdweb' tools which allow you to retrieve real-time "
@@ -77,10 +84,10 @@ def build_graph(args):
 
     tools = get_langchain_tools(model.get_tools())
     tools += [extract_json_value, count_json_list]
-    if args.provider == "google":
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash-exp", temperature=args.temperature)
-    elif args.provider == "openai":
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=args.temperature)
+    if provider == "google":
+        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash-exp", temperature=temperature)
+    elif provider == "openai":
+        llm = ChatOpenAI(model="gpt-4o-mini", temperature=temperature)
     else:
         raise ValueError("Invalid provider. Use 'google' or 'openai'")
 
@@ -115,24 +122,14 @@ def chat_loop(graph, args):
             inputs = {"messages": messages + [user_input]}
             console.print(f"\n{args.model}:".title(), style="bold magenta")
 
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                TimeElapsedColumn(),
-                transient=True,
-            ) as progress:
-                task = progress.add_task("Processing...", total=None)
-                out = graph.invoke(inputs, config=config)
-                out["messages"][-2]
-
+            spinner = Spinner("dots", text="Processing...")
+            with Live(
+                spinner, console=console, refresh_per_second=10, transient=True
+            ) as live:
                 message = ""
                 for step in graph.stream(inputs, stream_mode="values", config=config):
                     message = step["messages"][-1]
-                    console.clear()
-                    console.print("\n")
-                    console.print(message, style="dim")
-
-                progress.remove_task(task)
+                    live.update(Group(spinner, Text(str(message), style="dim")))
 
             console.print(Panel.fit(message.content, border_style="magenta"))
             print()
@@ -1,3 +1,4 @@
+import os
 import uvicorn
 import argparse
 
@@ -9,11 +10,17 @@ def main():
     --host: Host to bind the server to (default: 127.0.0.1)
     --port: Port to bind the server to (default: 8000)
     --reload: Enable auto-reload for development (default: False)
+    --workers: Number of worker processes (default: number of CPUs, ignored with --reload)
+    --loop: Event loop implementation (default: auto, uvloop when installed)
+    --http: HTTP protocol implementation (default: auto, httptools when installed)
     """
     parser = argparse.ArgumentParser(description="Run the Thirdweb AI LangGraph API")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to bind the server to")
     parser.add_argument("--port", type=int, default=8000, help="Port to bind the server to")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload for development")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--loop", type=str, default="auto", help="Event loop implementation (auto, asyncio, uvloop)")
+    parser.add_argument("--http", type=str, default="auto", help="HTTP protocol implementation (auto, h11, httptools)")
     
     args = parser.parse_args()
     
@@ -21,8 +28,12 @@ def main():
         "api.main:app",
         host=args.host,
         port=args.port,
-        reload=args.reload
+        reload=args.reload,
+        # uvicorn runs a single process when reloading
+        workers=None if args.reload else args.workers,
+        loop=args.loop,
+        http=args.http
     )
 
 if __name__ == "__main__":
-    main() 
+    main()
@@ -1,11 +1,14 @@
+import re
+from collections import OrderedDict
 from enum import Enum
+from typing import Optional
 
-from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
-load_dotenv()
+import api.config  # Loads environment variables from .env
+from src.common.utils import ETH_REGEX
 
 
 class Intent(Enum):
@@ -78,6 +81,84 @@ Message: {message}
 intent_prompt = ChatPromptTemplate.from_template(intent_template)
 intent_chain = intent_prompt | llm_intent
 
+
+# Unambiguous trigger words for each intent, taken from the classifier prompt
+INTENT_KEYWORDS = {
+    Intent.nebula_query: ["price", "prices", "send", "transfer", "swap", "bridge"],
+    Intent.blockchain_query: [
+        "blockchain", "ethereum", "token", "tokens", "nft", "nfts",
+        "erc20", "erc721", "contract", "ens",
+    ],
+    Intent.financial_query: [
+        "customer", "customers", "expense", "expenses", "spending", "product", "products",
+        "sale", "sales", "revenue", "profit", "profits", "inventory", "invoice", "invoices",
+    ],
+    Intent.general_query: [
+        "hey", "hello", "hi", "what's up", "good morning", "help",
+        "who are you", "what are you", "what can you do",
+    ],
+}
+
+# One alternation per intent, matched on word boundaries
+_KEYWORD_PATTERNS = {
+    intent: re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + r")\b")
+    for intent, keywords in INTENT_KEYWORDS.items()
+}
+
+
+def match_keywords(message: str):
+    """
+    Returns the intent whose keywords appear in the normalized message,
+    or None when no intent or more than one intent matches.
+    """
+    matches = [intent for intent, pattern in _KEYWORD_PATTERNS.items() if pattern.search(message)]
+    return matches[0] if len(matches) == 1 else None
+
+
+# LLM classifications keyed by normalized message, oldest first
+_INTENT_CACHE_SIZE = 1024
+_intent_cache: "OrderedDict[str, Intent]" = OrderedDict()
+
+
+def _normalize(message: str) -> str:
+    """Masks wallet addresses and lowercases the message for cache lookups."""
+    return ETH_REGEX.sub("0xADDR", message.strip()).lower()
+
+
+def _classify_without_llm(normalized: str) -> Optional[Intent]:
+    """
+    Classifies a normalized message without calling the LLM, returning None
+    when the LLM is needed. Empty or single-character messages are general queries.
+    """
+    if len(normalized) < 2:
+        return Intent.general_query
+    if normalized in _intent_cache:
+        _intent_cache.move_to_end(normalized)
+        return _intent_cache[normalized]
+    return match_keywords(normalized)
+
+
+def _remember(normalized: str, intent: Intent) -> Intent:
+    _intent_cache[normalized] = intent
+    if len(_intent_cache) > _INTENT_CACHE_SIZE:
+        _intent_cache.popitem(last=False)
+    return intent
+
+
+async def aclassify(message: str) -> Intent:
+    """
+    Classifies a message, caching results by normalized message text.
+    Wallet addresses are masked so queries differing only in the address share
+    a cache entry. Messages matching keywords for a single intent skip the LLM call entirely,
+    as do empty or single-character messages, which are general queries.
+    """
+    normalized = _normalize(message)
+    intent = _classify_without_llm(normalized)
+    if intent is None:
+        result = await intent_chain.ainvoke({"message": normalized})
+        intent = _remember(normalized, result.intent)
+    return intent
+
 if __name__ == "__main__":
     test_messages = [
         "What is the blockchain?",
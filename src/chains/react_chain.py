@@ -1,30 +1,42 @@
-from dotenv import load_dotenv
 from langchain_core.prompts import PromptTemplate
 from langchain_core.tools import tool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
-from src.llm import LLM, FALLBACK_LLM
+import api.config  # Loads environment variables from .env
+from src.common.http import per_event_loop
+from src.llm import get_fallback_llm, get_llm
 from src.tools import (
+    batch_nebula,
+    blockchain_and_web,
     call_nebula_api,
     count_json_list,
     extract_json_value,
     insight_tools,
     retrieve_web_content,
+    retrieve_web_content_batch,
     get_financial_data,
     analyze_expenses,
-    get_customer_insights
+    get_customer_insights,
+    full_dashboard
 )
 
-load_dotenv()
-
 json_tools = [extract_json_value, count_json_list]
-web_tools = [retrieve_web_content]
-nebula_tools = [call_nebula_api]
+web_tools = [retrieve_web_content, retrieve_web_content_batch, blockchain_and_web]
+nebula_tools = [call_nebula_api, batch_nebula]
 
-react_tools = insight_tools + json_tools + web_tools + nebula_tools + [
+react_tools = (
+    *insight_tools,
+    *json_tools,
+    *web_tools,
+    *nebula_tools,
     get_financial_data,
     analyze_expenses,
-    get_customer_insights
-]
+    get_customer_insights,
+    full_dashboard,
+)
+
+# Serialize the tool schemas once and share them between the primary and fallback LLMs
+react_tool_schemas = [convert_to_openai_tool(t) for t in react_tools]
 
 react_template = """
 You have access to a selection of tools, which allow you to retrieve real-time Blockchain data. **Never attempt to guess Blockchain-related information—always use the available tools.**
@@ -62,7 +74,12 @@ Your goal is **accuracy and completeness.** Always combine Blockchain data with
 
 react_prompt = PromptTemplate.from_template(react_template)
 
-if FALLBACK_LLM:
-    react_llm = LLM.bind_tools(react_tools) or FALLBACK_LLM.bind_tools(react_tools)
-else:
-    react_llm = LLM.bind_tools(react_tools)
+@per_event_loop
+def get_react_llm():
+    """Returns the tool-bound react LLM for the running event loop, creating the LLM clients on first use."""
+    react_llm = get_llm().bind_tools(react_tool_schemas)
+    fallback_llm = get_fallback_llm()
+    if fallback_llm:
+        # Retry with the fallback LLM if the primary LLM call raises
+        react_llm = react_llm.with_fallbacks([fallback_llm.bind_tools(react_tool_schemas)])
+    return react_llm
@@ -0,0 +1,42 @@
+import asyncio
+import weakref
+from functools import cache, wraps
+
+import httpx
+
+# Keep idle connections open so repeated LLM and Nebula calls skip the TCP/TLS handshake
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=300)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+# Retry requests whose connection could not be established
+HTTP_RETRIES = 3
+
+
+def per_event_loop(factory):
+    """
+    Caches a factory's result separately for each running event loop.
+    Results are dropped together with their loop.
+    """
+    results = weakref.WeakKeyDictionary()
+
+    @wraps(factory)
+    def wrapper():
+        loop = asyncio.get_running_loop()
+        if loop not in results:
+            results[loop] = factory()
+        return results[loop]
+    return wrapper
+
+
+@cache
+def get_http_client() -> httpx.Client:
+    """Returns the shared synchronous HTTP client, created on first use."""
+    transport = httpx.HTTPTransport(limits=HTTP_LIMITS, retries=HTTP_RETRIES)
+    return httpx.Client(transport=transport, timeout=HTTP_TIMEOUT)
+
+
+# Async connections are bound to the event loop that opened them, so each loop gets its own client
+@per_event_loop
+def get_async_http_client() -> httpx.AsyncClient:
+    """Returns the shared asynchronous HTTP client for the running event loop, created on first use."""
+    transport = httpx.AsyncHTTPTransport(limits=HTTP_LIMITS, retries=HTTP_RETRIES)
+    return httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT)
@@ -1,16 +1,25 @@
-import re
+import asyncio
+import hashlib
 import logging
+import threading
+import time
 import json
-from typing import Literal, List, Dict, Any
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Literal, List, Dict, Any, Optional
 
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, message_chunk_to_message
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, START, MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode
 
-from src.chains.intent_chain import intent_chain, Intent
-from src.chains.react_chain import react_llm, react_template, react_tools
+from src.chains.intent_chain import aclassify, Intent
+from src.chains.react_chain import get_react_llm, react_template, react_tools
 from src.common.utils import ETH_REGEX
+from src.llm import get_summary_llm
+from src.tools import call_nebula_api
+
+logger = logging.getLogger(__name__)
 
 # Import MongoDB database tools if they exist in src/tools.py
 # Update imports based on your actual implementation
@@ -23,83 +32,156 @@ except ImportError:
     def get_customer_insights(user_id: str): return {"error": "Tool not implemented"}
 
 
+FINANCIAL_PROMPT = """
+You are a financial analyst AI assistant with access to business financial data in MongoDB.
+Use these tools to analyze the data and answer financial questions:
+- For customer data queries, use get_customer_insights
+- For expense analysis, use analyze_expenses
+- For overall financial data, use get_financial_data
+- For an overview that needs all of the above, use full_dashboard
+
+Always analyze the data before responding, and provide specific insights based on what you find.
+"""
+
+# The system prompts never change, so every conversation shares one message instance
+REACT_SYSTEM_MESSAGE = SystemMessage(content=react_template)
+FINANCIAL_SYSTEM_MESSAGE = SystemMessage(content=FINANCIAL_PROMPT)
+
+
 class State(MessagesState):
     wallets: dict = {}
     tools_used: List[Dict[str, Any]] = []
     user_id: str = "default_user"
+    intent: Optional[str] = None
+    intent_error: Optional[str] = None
+    wallet_matches: List[str] = []
+    has_system_prompt: bool = False
+    flow: str = "general"
+    last_human_idx: int = -1
+    summary: str = ""
+    summarized_count: int = 0
+
+
+# Oldest entries are dropped once the log reaches this size, keeping long sessions bounded
+TOOLS_USED_LIMIT = 64
+
+
+def record_tool(state: State, entry: Dict[str, Any]) -> None:
+    """Appends a tool usage entry to the state, keeping only the most recent TOOLS_USED_LIMIT entries."""
+    tools_used = state["tools_used"]
+    tools_used.append(entry)
+    if len(tools_used) > TOOLS_USED_LIMIT:
+        del tools_used[:-TOOLS_USED_LIMIT]
+
+
+def find_latest_human_idx(messages: List[Any]) -> int:
+    """Returns the index of the most recent HumanMessage, or -1 if there is none."""
+    for idx in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[idx], HumanMessage):
+            return idx
+    return -1
+
+
+def insert_system_message(state: State, message: SystemMessage) -> None:
+    """Prepends a system message, keeping last_human_idx on the same message."""
+    state["messages"].insert(0, message)
+    if state.get("last_human_idx", -1) >= 0:
+        state["last_human_idx"] += 1
 
 
 def get_latest_human_message(state: State) -> str:
     """
     Extracts the most recent human message content from the state.
+    Uses the index stored by classify_and_extract when it is still valid.
     Returns an empty string if no human message is found.
     """
-    # Find the most recent HumanMessage in the state
-    message_content = ""
-    for msg in reversed(state["messages"]):
-        if isinstance(msg, HumanMessage) and hasattr(msg, "content"):
-            message_content = msg.content
-            break
+    messages = state["messages"]
+    idx = state.get("last_human_idx", -1)
+    if not (0 <= idx < len(messages) and isinstance(messages[idx], HumanMessage)):
+        idx = find_latest_human_idx(messages)
+    message_content = messages[idx].content if idx >= 0 else ""
     
     # Fall back to the first message if no HumanMessage is found
-    if not message_content and state["messages"]:
-        message = state["messages"][0]
+    if not message_content and messages:
+        message = messages[0]
         message_content = message.content if hasattr(message, "content") else str(message)
         
     return message_content
 
 
-def intent_router(state: State):
-    """Routes messages based on the detected intent."""
+async def classify_and_extract(state: State) -> State:
+    """
+    Scans the latest message for wallets and classifies its intent.
+    A detected wallet always routes to wallet extraction, so the intent
+    classification call is skipped in that case.
+    """
+    # Later nodes read the latest human message through this index
+    state["last_human_idx"] = find_latest_human_idx(state["messages"])
     message_content = get_latest_human_message(state)
+    # Handlers set the flow for this turn; default to the general flow
+    state["flow"] = "general"
+    
+    state["wallet_matches"] = ETH_REGEX.findall(message_content)
+    if state["wallet_matches"]:
+        state["intent"] = None
+        state["intent_error"] = None
+        return state
     
     try:
-        # Call the intent chain to classify the message
-        result = intent_chain.invoke({"message": message_content})
-        intent = result.intent
-        
-        logging.warning(f"LLM intent detected: {intent} for message: '{message_content}'")
-        
-        # Check for direct wallet detection first
-        wallet_matches = re.findall(ETH_REGEX, message_content)
-        if wallet_matches:
-            state["tools_used"].append({
-                "tool": "intent_router",
-                "decision": "extract_wallets",
-                "trigger": f"wallets detected: {wallet_matches}"
-            })
-            return "extract_wallets"
-        
-        # Route based on the detected intent
-        if intent == Intent.nebula_query:
-            state["tools_used"].append({
-                "tool": "intent_router",
-                "decision": "nebula_handler",
-                "trigger": "nebula query intent"
-            })
-            return "nebula_handler"
-        elif intent == Intent.financial_query:
-            state["tools_used"].append({
-                "tool": "intent_router",
-                "decision": "financial_handler",
-                "trigger": "financial query intent"
-            })
-            return "financial_handler"
-        else:
-            state["tools_used"].append({
-                "tool": "intent_router",
-                "decision": "general_handler",
-                "trigger": "general query intent or fallback"
-            })
-            return "general_handler"
-            
+        intent = await aclassify(message_content)
+        state["intent"] = intent.value
+        state["intent_error"] = None
+        logger.debug("LLM intent detected: %s for message: '%s'", intent, message_content)
     except Exception as e:
-        logging.error(f"Error in intent classification: {e}")
-        # Fall back to general handler on error
-        state["tools_used"].append({
+        logger.error("Error in intent classification: %s", e)
+        state["intent"] = None
+        state["intent_error"] = str(e)
+    
+    return state
+
+
+def intent_router(state: State):
+    """Routes messages based on the detected intent."""
+    # Check for direct wallet detection first
+    wallet_matches = state.get("wallet_matches")
+    if wallet_matches:
+        record_tool(state, {
+            "tool": "intent_router",
+            "decision": "extract_wallets",
+            "trigger": f"wallets detected: {wallet_matches}"
+        })
+        return "extract_wallets"
+    
+    # Fall back to general handler on error
+    if state.get("intent_error"):
+        record_tool(state, {
+            "tool": "intent_router",
+            "decision": "general_handler",
+            "trigger": f"error in intent classification: {state['intent_error']}"
+        })
+        return "general_handler"
+    
+    # Route based on the detected intent
+    intent = state.get("intent")
+    if intent == Intent.nebula_query.value:
+        record_tool(state, {
+            "tool": "intent_router",
+            "decision": "nebula_handler",
+            "trigger": "nebula query intent"
+        })
+        return "nebula_handler"
+    elif intent == Intent.financial_query.value:
+        record_tool(state, {
+            "tool": "intent_router",
+            "decision": "financial_handler",
+            "trigger": "financial query intent"
+        })
+        return "financial_handler"
+    else:
+        record_tool(state, {
             "tool": "intent_router",
             "decision": "general_handler",
-            "trigger": f"error in intent classification: {str(e)}"
+            "trigger": "general query intent or fallback"
         })
         return "general_handler"
 
@@ -109,51 +191,120 @@ def extract_wallets(state: State) -> State:
     message = state["messages"][-1]
     
     if not hasattr(message, "content") or not message.content:
-        logging.warning("No content found in message for wallet extraction")
-        state["tools_used"].append({
+        logger.debug("No content found in message for wallet extraction")
+        record_tool(state, {
             "tool": "extract_wallets",
             "wallets_found": 0,
             "error": "No content in message"
         })
         return state
         
-    logging.warning(f"Extracting wallets from: {message.content[:50]}...")
+    logger.debug("Extracting wallets from: %s...", message.content[:50])
     
-    if wallets := re.findall(ETH_REGEX, message.content):
+    # Reuse the matches found while the intent was being classified
+    if wallets := state.get("wallet_matches") or ETH_REGEX.findall(message.content):
         # for now skip this as it confuses the LLM
         # for idx, wallet in enumerate(wallet
         #     message.content = re.sub(wallet, f"{{wallet_{idx}}}", message.content)
 
         wallet_dict = {f"wallet_{idx}": wallet for idx, wallet in enumerate(wallets)}
         state["wallets"] = wallet_dict
-        state["tools_used"].append({
+        record_tool(state, {
             "tool": "extract_wallets",
             "wallets_found": len(wallets),
             "wallets": list(wallet_dict.values())
         })
-        logging.warning(f"Found {len(wallets)} wallet(s): {list(wallet_dict.values())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found %s wallet(s): %s", len(wallets), list(wallet_dict.values()))
     else:
-        state["tools_used"].append({
+        record_tool(state, {
             "tool": "extract_wallets",
             "wallets_found": 0
         })
-        logging.warning("No wallets found in message")
+        logger.debug("No wallets found in message")
     return state
 
 
+# Financial tools that take the user_id of the conversation
+FINANCIAL_TOOL_NAMES = frozenset({"get_financial_data", "analyze_expenses", "get_customer_insights", "full_dashboard"})
+
+
+# Per-tool functions that fill wallet addresses into a tool call's args
+_ARG_INJECTORS = {
+    "get_erc20_tokens": lambda args, addresses: args.update(owner_address=addresses[0]),
+    "resolve": lambda args, addresses: args.update(input_data=addresses[0]),
+    "get_token_prices": lambda args, addresses: args.update(token_addresses=list(addresses)),
+}
+
+
 def _inject_wallets_tool(out: AIMessage, wallets: dict):
-    # for now just assume a single wallet
-    tool_name = out.tool_calls[0]["name"]
-    if tool_name == "get_erc20_tokens":
-        out.tool_calls[0]["args"]["owner_address"] = list(wallets.values())[0]
-    elif tool_name == "resolve":
-        out.tool_calls[0]["args"]["input_data"] = list(wallets.values())[0]
-    elif tool_name == "get_token_prices":
-        out.tool_calls[0]["args"]["token_addresses"] = list(wallets.values())
+    # for now just assume a single wallet per argument
+    addresses = tuple(wallets.values())
+    for tool_call in out.tool_calls:
+        injector = _ARG_INJECTORS.get(tool_call["name"])
+        if injector:
+            injector(tool_call["args"], addresses)
     return out
 
 
-def agent(state: State):
+# Once the history passes HISTORY_MAX messages, the oldest messages are folded into a running
+# summary HISTORY_STEP at a time, so at least HISTORY_KEEP recent messages are always sent as is
+HISTORY_MAX = 16
+HISTORY_KEEP = 12
+HISTORY_STEP = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below in a few sentences. Keep wallet addresses, token addresses, "
+    "figures and any other facts needed to continue the conversation."
+)
+
+
+async def _summarize_history(summary: str, messages: List[Any]) -> str:
+    """Extends the running summary with the given messages."""
+    transcript = "\n".join(f"{msg.type}: {msg.content}" for msg in messages if msg.content)
+    if summary:
+        transcript = f"Summary so far: {summary}\n\n{transcript}"
+    response = await get_summary_llm().ainvoke([SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=transcript)])
+    return response.content
+
+
+async def _windowed_messages(state: State, messages: List[Any]) -> List[Any]:
+    """
+    Returns the messages to send to the LLM: the system prompt with the running summary,
+    followed by the most recent messages. Short histories are returned unchanged.
+    """
+    system = messages[:1] if isinstance(messages[0], SystemMessage) else []
+    history = messages[len(system):]
+    if len(history) <= HISTORY_MAX:
+        return messages
+    
+    cut = (len(history) - HISTORY_KEEP) // HISTORY_STEP * HISTORY_STEP
+    # The window must start on a user turn: Gemini rejects tool calls and tool results that
+    # don't follow one. Move forward to the next HumanMessage, or back to the start of the
+    # current turn if the rest of the history is a single tool loop.
+    while cut < len(history) and not isinstance(history[cut], HumanMessage):
+        cut += 1
+    if cut == len(history):
+        cut = find_latest_human_idx(history)
+        if cut <= 0:
+            return messages
+    
+    summarized_count = state.get("summarized_count", 0)
+    if cut > summarized_count:
+        try:
+            state["summary"] = await _summarize_history(state.get("summary", ""), history[summarized_count:cut])
+            state["summarized_count"] = cut
+        except Exception as e:
+            logger.error("Error summarizing conversation history: %s", e)
+            return messages
+    
+    summary_text = f"Summary of the earlier conversation: {state['summary']}"
+    if system:
+        summary_text = f"{system[0].content}\n\n{summary_text}"
+    return [SystemMessage(content=summary_text), *history[cut:]]
+
+
+async def agent(state: State):
     """Agent function to process messages using LLM."""
     messages = state["messages"]
     wallets = state.get("wallets", {})
@@ -161,71 +312,70 @@ def agent(state: State):
     
     # Check if the financial system prompt needs to be added (if financial_handler didn't add it)
     # Or ensure the standard react prompt is added if not financial
-    is_financial_flow = any(item.get("tool") == "financial_handler" for item in state.get("tools_used", []))
-    has_system_prompt = any(isinstance(msg, SystemMessage) for msg in messages)
-
-    if not has_system_prompt:
-        if is_financial_flow:
+    if not state.get("has_system_prompt"):
+        if state.get("flow") == "financial":
             # Add financial prompt if not already present (should be added by handler, but as fallback)
-            system_prompt = """
-            You are a financial analyst AI assistant with access to business financial data in MongoDB.
-            Use these tools to analyze the data and answer financial questions:
-            - For customer data queries, use get_customer_insights
-            - For expense analysis, use analyze_expenses
-            - For overall financial data, use get_financial_data
-            
-            Always analyze the data before responding, and provide specific insights based on what you find.
-            """
-            messages.insert(0, SystemMessage(content=system_prompt))
-            logging.warning("Agent added Financial System Prompt (fallback)")
+            insert_system_message(state, FINANCIAL_SYSTEM_MESSAGE)
+            logger.debug("Agent added Financial System Prompt (fallback)")
         else:
              # Add the standard React template if no system prompt exists
-            messages.insert(0, SystemMessage(content=react_template))
-            logging.warning("Agent added React System Prompt")
+            insert_system_message(state, REACT_SYSTEM_MESSAGE)
+            logger.debug("Agent added React System Prompt")
+        state["has_system_prompt"] = True
 
     # Ensure the last message is a valid type for LLM invocation
     if not isinstance(messages[-1], (AIMessage, HumanMessage, SystemMessage, ToolMessage)):
-        logging.warning(f"Converting message of type {type(messages[-1])} to HumanMessage")
+        logger.debug("Converting message of type %s to HumanMessage", type(messages[-1]))
         messages[-1] = HumanMessage(content=str(messages[-1]))
 
     # Log what we're about to do
-    logging.warning(f"Invoking React LLM with {len(messages)} messages, last message type: {type(messages[-1])}")
+    logger.debug("Invoking React LLM with %s messages, last message type: %s", len(messages), type(messages[-1]))
     
-    # Invoke the LLM with the current messages
+    # Invoke the LLM with the recent messages and a summary of older ones
     try:
-        out = react_llm.invoke(messages)
+        prompt_messages = await _windowed_messages(state, messages)
+        
+        # Stream the response so tokens reach stream_mode="messages" consumers as they arrive;
+        # tool calls are only complete once every chunk has been merged
+        out = None
+        async for chunk in get_react_llm().astream(prompt_messages):
+            out = chunk if out is None else out + chunk
+        if out is None:
+            raise ValueError("React LLM returned an empty response")
+        out = message_chunk_to_message(out)
         
         # Check if we have tool calls and wallets to inject
         if hasattr(out, "tool_calls") and out.tool_calls and wallets:
-            logging.warning(f"Injecting wallet information into tool calls: {list(wallets.values())}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Injecting wallet information into tool calls: %s", list(wallets.values()))
             out = _inject_wallets_tool(out, wallets)
-            state["tools_used"].append({
+            record_tool(state, {
                 "tool": "agent",
                 "action": "inject_wallets",
                 "tools_called": [call["name"] for call in out.tool_calls],
                 "wallets": list(wallets.values())
             })
         # Check if we have financial data tool calls that need user_id
-        elif hasattr(out, "tool_calls") and out.tool_calls and any(call["name"] in ["get_financial_data", "analyze_expenses", "get_customer_insights"] 
+        elif hasattr(out, "tool_calls") and out.tool_calls and any(call["name"] in FINANCIAL_TOOL_NAMES 
                                    for call in out.tool_calls):
             # Add user_id to tool calls if needed
-            logging.warning(f"Injecting user_id ({user_id}) into financial tool calls")
+            logger.debug("Injecting user_id (%s) into financial tool calls", user_id)
             for call in out.tool_calls:
-                if call["name"] in ["get_financial_data", "analyze_expenses", "get_customer_insights"]:
+                if call["name"] in FINANCIAL_TOOL_NAMES:
                     # Ensure args is a dict
                     call_args = call.get("args", {})
                     if isinstance(call_args, str):
                         try:
                             call_args = json.loads(call_args)
                         except json.JSONDecodeError:
-                            logging.error(f"Failed to parse args for tool {call['name']}: {call_args}")
+                            logger.error("Failed to parse args for tool %s: %s", call['name'], call_args)
                             call_args = {}
                             
                     if "user_id" not in call_args:
                         call_args["user_id"] = user_id
                         call["args"] = call_args # Update args in the call
             
-            state["tools_used"].append({
+            record_tool(state, {
                 "tool": "agent",
                 "action": "financial_tool_calls",
                 "tools_called": [call["name"] for call in out.tool_calls],
@@ -233,16 +383,16 @@ def agent(state: State):
             })
         elif hasattr(out, "tool_calls") and out.tool_calls:
             tool_names = [call["name"] for call in out.tool_calls]
-            logging.warning(f"LLM wants to call tools: {tool_names}")
-            state["tools_used"].append({
+            logger.debug("LLM wants to call tools: %s", tool_names)
+            record_tool(state, {
                 "tool": "agent",
                 "action": "tool_calls",
                 "tools_called": tool_names
             })
         else:
             response_length = len(out.content) if hasattr(out, "content") else 0
-            logging.warning(f"LLM generated direct response of length {response_length}")
-            state["tools_used"].append({
+            logger.debug("LLM generated direct response of length %s", response_length)
+            record_tool(state, {
                 "tool": "agent",
                 "action": "direct_response",
                 "response_length": response_length
@@ -253,8 +403,8 @@ def agent(state: State):
     except Exception as e:
         # Handle any errors that might occur during LLM invocation
         error_msg = f"Error in React LLM invocation: {e}"
-        logging.error(error_msg)
-        state["tools_used"].append({
+        logger.error(error_msg)
+        record_tool(state, {
             "tool": "agent",
             "action": "error",
             "error": str(e)
@@ -266,31 +416,76 @@ def agent(state: State):
     return state
 
 
-def nebula_handler(state: State):
-    """Handles queries that should be directed to the Nebula API."""
-    from src.tools import call_nebula_api
-    import json
+# Read-only Nebula answers include prices and balances, so they are only reused briefly.
+# nebula_handler runs in executor threads, so the cache is guarded by a lock
+NEBULA_CACHE_TTL = 30
+NEBULA_CACHE_SIZE = 256
+_nebula_cache: "OrderedDict[tuple, tuple[float, MappingProxyType]]" = OrderedDict()
+_nebula_cache_lock = threading.Lock()
+
+
+def _nebula_read_cached(message: str, user_id: str):
+    """Calls Nebula for a read-only query, reusing successful responses for NEBULA_CACHE_TTL seconds."""
+    key = (message, user_id)
+    with _nebula_cache_lock:
+        entry = _nebula_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _nebula_cache.move_to_end(key)
+            return entry[1]
     
+    response = call_nebula_api.invoke({
+        "message": message,
+        "execute": False,
+        "user_id": user_id
+    })
+    if "error" in response:
+        return response
+    
+    # Freeze the response since every caller shares the cached object
+    frozen = MappingProxyType(response)
+    with _nebula_cache_lock:
+        _nebula_cache[key] = (time.monotonic() + NEBULA_CACHE_TTL, frozen)
+        _nebula_cache.move_to_end(key)
+        if len(_nebula_cache) > NEBULA_CACHE_SIZE:
+            _nebula_cache.popitem(last=False)
+    return frozen
+
+
+def _call_nebula(message: str, execute: bool, user_id: str):
+    """Calls Nebula, serving repeated read-only queries from the cache."""
+    if execute:
+        return call_nebula_api.invoke({
+            "message": message,
+            "execute": True,
+            "user_id": user_id
+        })
+    return _nebula_read_cached(message, user_id)
+
+
+def nebula_handler(state: State):
+    """Handles queries that should be directed to the Nebula API."""    
     message_content = get_latest_human_message(state)
-    logging.warning(f"Nebula handler processing: {message_content[:50]}...")
+    logger.debug("Nebula handler processing: %s...", message_content[:50])
     wallets = state.get("wallets", {})
-    user_id = f"user-{hash(json.dumps(wallets)) % 10000}" if wallets else "insight-user"
+    if wallets:
+        # Stable across processes (unlike hash()), so Nebula sees the same user for the same wallets
+        wallet_key = "|".join(f"{k}={v}" for k, v in sorted(wallets.items())).encode()
+        user_id = "user-" + hashlib.blake2b(wallet_key, digest_size=4).hexdigest()
+    else:
+        user_id = "insight-user"
     execute_tx = "sign" in message_content.lower() or "execute" in message_content.lower() or "send" in message_content.lower()
     
     try:
-        nebula_response = call_nebula_api.invoke({
-            "message": message_content,
-            "execute": execute_tx,
-            "user_id": user_id
-        })
+        nebula_response = _call_nebula(message_content, execute_tx, user_id)
         
-        logging.warning(f"Nebula API response: {str(nebula_response)[:100]}...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Nebula API response: %s...", str(nebula_response)[:100])
         
         response_content = nebula_response.get("message", "Error processing Nebula response.")
         if "error" in nebula_response:
             response_content = f"Error from Nebula API: {nebula_response.get('error')}"
         
-        state["tools_used"].append({
+        record_tool(state, {
             "tool": "nebula_handler",
             "execute_tx": execute_tx,
             "success": "error" not in nebula_response,
@@ -304,9 +499,9 @@ def nebula_handler(state: State):
         ai_message = AIMessage(content=response_content)
         
     except Exception as e:
-        logging.error(f"Error in Nebula handler: {e}")
+        logger.error("Error in Nebula handler: %s", e)
         ai_message = AIMessage(content=f"I encountered an error when trying to get blockchain data: {str(e)}")
-        state["tools_used"].append({"tool": "nebula_handler", "success": False, "error": str(e)})
+        record_tool(state, {"tool": "nebula_handler", "success": False, "error": str(e)})
     
     state["messages"].append(ai_message)
     return state
@@ -319,65 +514,73 @@ def should_continue(state: State) -> Literal["tools", "inject_params", END]:
 
     # If the last message is not an AIMessage, end.
     if not isinstance(last_message, AIMessage):
-        state["tools_used"].append({
+        record_tool(state, {
             "tool": "should_continue",
             "decision": "END",
             "reason": f"Last message is not AIMessage: {type(last_message)}"
         })
-        logging.warning(f"should_continue: ending because last message is not AIMessage: {type(last_message)}")
+        logger.debug("should_continue: ending because last message is not AIMessage: %s", type(last_message))
         return END
 
     # If the AIMessage has tool calls, route to the tools node.
     if hasattr(last_message, "tool_calls") and last_message.tool_calls:
         tool_names = [call["name"] for call in last_message.tool_calls]
-        state["tools_used"].append({
+        record_tool(state, {
             "tool": "should_continue",
             "decision": "tools",
             "reason": "AIMessage has tool calls",
             "tools": tool_names
         })
-        logging.warning(f"should_continue: routing to tools node with tool calls: {tool_names}")
+        logger.debug("should_continue: routing to tools node with tool calls: %s", tool_names)
         return "tools"
 
     # Otherwise, route to inject_params to finalize the response.
-    state["tools_used"].append({
+    record_tool(state, {
         "tool": "should_continue",
         "decision": "inject_params",
         "reason": "AIMessage has no tool calls"
     })
-    logging.warning("should_continue: proceeding to inject_params")
+    logger.debug("should_continue: proceeding to inject_params")
     return "inject_params"
 
 
+class _SafeDict(dict):
+    """Mapping for format_map that leaves unknown placeholders in place."""
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
 def inject_params(state: State) -> State:
     messages = state["messages"]
     last_message = messages[-1]
     
     if isinstance(last_message, AIMessage) and hasattr(last_message, "content"):
         try:
-            # Attempt to format with wallets, handle missing keys gracefully
-            if state.get("wallets"):
-                last_message.content = last_message.content.format_map(state["wallets"])
-                state["tools_used"].append({
+            # Format with wallets, leaving placeholders without a wallet untouched.
+            # Responses without a wallet placeholder are left as they are.
+            if state.get("wallets") and "{wallet_" in last_message.content:
+                last_message.content = last_message.content.format_map(_SafeDict(state["wallets"]))
+                record_tool(state, {
                     "tool": "inject_params",
                     "action": "format_with_wallets",
                     "wallets_count": len(state["wallets"])
                 })
+            elif state.get("wallets"):
+                record_tool(state, {
+                    "tool": "inject_params",
+                    "action": "no_wallet_placeholders"
+                })
             else:
-                 state["tools_used"].append({
+                 record_tool(state, {
                     "tool": "inject_params",
                     "action": "no_wallets_to_format"
                  })
-        except KeyError as e:
-            # Log specific key error but don't crash
-            logging.warning(f"Inject_params formatting error (KeyError): {e}. Content: {last_message.content}")
-            state["tools_used"].append({"tool": "inject_params", "action": "format_key_error", "error": str(e)})
         except Exception as e:
              # Catch other potential formatting errors
-            logging.error(f"Inject_params formatting error: {e}. Content: {last_message.content}")
-            state["tools_used"].append({"tool": "inject_params", "action": "format_error", "error": str(e)})
+            logger.error("Inject_params formatting error: %s. Content: %s", e, last_message.content)
+            record_tool(state, {"tool": "inject_params", "action": "format_error", "error": str(e)})
     else:
-        state["tools_used"].append({
+        record_tool(state, {
             "tool": "inject_params",
             "action": "no_formatting_needed",
             "reason": f"Last message type: {type(last_message)}"
@@ -395,53 +598,49 @@ def financial_handler(state: State):
     message_content = get_latest_human_message(state)
     user_id = state.get("user_id", "default_user")
     
-    logging.warning(f"Financial handler processing message: '{message_content}' for user: {user_id}")
+    logger.debug("Financial handler processing message: '%s' for user: %s", message_content, user_id)
     
-    # Add financial system prompt to guide the agent
-    system_prompt = """
-You are a financial analyst AI assistant with access to business financial data in MongoDB.
-Use these tools to analyze the data and answer financial questions:
-- For customer data queries, use get_customer_insights
-- For expense analysis, use analyze_expenses
-- For overall financial data, use get_financial_data
-
-Always analyze the data before responding, and provide specific insights based on what you find.
-    """
-    
-    system_message = SystemMessage(content=system_prompt)
+    state["flow"] = "financial"
     
     # Prepend the system message if it's not already there
-    if not any(isinstance(msg, SystemMessage) for msg in state["messages"]):
-        state["messages"].insert(0, system_message)
-        state["tools_used"].append({
+    if not state.get("has_system_prompt"):
+        insert_system_message(state, FINANCIAL_SYSTEM_MESSAGE)
+        state["has_system_prompt"] = True
+        record_tool(state, {
             "tool": "financial_handler",
             "action": "added_financial_prompt"
         })
-        logging.info("Financial system prompt added.")
+        logger.debug("Financial system prompt added.")
     else:
-        logging.warning("System prompt already exists, not adding financial prompt again.")
+        logger.debug("System prompt already exists, not adding financial prompt again.")
 
     # No direct tool calls here - always delegate to the main agent node
-    logging.warning(f"Financial handler delegating to agent node for: '{message_content}'")
+    logger.debug("Financial handler delegating to agent node for: '%s'", message_content)
     
     # The graph structure will now direct this state to the 'agent' node
     return state 
 
 
-def build_graph():
-    """Constructs and compiles the agent execution graph."""
+def build_graph(checkpointer=None):
+    """
+    Constructs and compiles the agent execution graph.
+    Uses an in-process MemorySaver unless another checkpointer is given.
+    """
     builder = StateGraph(State)
+    builder.add_node("classify_and_extract", classify_and_extract)
     builder.add_node("extract_wallets", extract_wallets)
     builder.add_node("agent", agent)
+    # The graph is run asynchronously, so ToolNode runs the tool calls of one response concurrently
     builder.add_node("tools", ToolNode(react_tools))
     builder.add_node("inject_params", inject_params)
     builder.add_node("nebula_handler", nebula_handler)
     builder.add_node("general_handler", general_handler) 
     builder.add_node("financial_handler", financial_handler)
 
-    # Intent routing at the start
+    # Intent classification and wallet scanning at the start, then routing
+    builder.add_edge(START, "classify_and_extract")
     builder.add_conditional_edges(
-        START,
+        "classify_and_extract",
         intent_router,
         {
             "extract_wallets": "extract_wallets", 
@@ -466,7 +665,7 @@ def build_graph():
     builder.add_edge("tools", "agent") # Loop back to agent after tools run
     builder.add_edge("inject_params", END) # Final step before ending
 
-    return builder.compile(checkpointer=MemorySaver())
+    return builder.compile(checkpointer=checkpointer or MemorySaver())
 
 
 def general_handler(state: State):
@@ -475,25 +674,29 @@ def general_handler(state: State):
     Adds the standard react prompt if needed and passes to the agent.
     """
     message_content = get_latest_human_message(state)
-    logging.warning(f"General handler processing message: '{message_content}'")
+    logger.debug("General handler processing message: '%s'", message_content)
+    
+    state["flow"] = "general"
     
     # Ensure the standard react prompt is present if no system prompt exists
-    if not any(isinstance(msg, SystemMessage) for msg in state["messages"]):
-        state["messages"].insert(0, SystemMessage(content=react_template))
-        state["tools_used"].append({
+    if not state.get("has_system_prompt"):
+        insert_system_message(state, REACT_SYSTEM_MESSAGE)
+        state["has_system_prompt"] = True
+        record_tool(state, {
             "tool": "general_handler",
             "action": "added_react_prompt"
         })
-        logging.info("Standard React system prompt added.")
+        logger.debug("Standard React system prompt added.")
     else:
-         logging.warning("System prompt already exists, not adding react prompt again.")
+         logger.debug("System prompt already exists, not adding react prompt again.")
 
     # Delegate to the main agent node
-    logging.warning(f"General handler delegating to agent node for: '{message_content}'")
+    logger.debug("General handler delegating to agent node for: '%s'", message_content)
     return state
 
 
-if __name__ == "__main__":
+async def _run_example():
+    """Runs an example query through the graph, printing each step."""
     config = {"configurable": {"thread_id": "1"}}
 
     # Example Financial Query
@@ -522,7 +725,7 @@ if __name__ == "__main__":
     # Stream the execution
     print("\n--- Running Graph ---")
     final_state = None
-    for step in graph.stream(inputs, config=config, stream_mode="values"):
+    async for step in graph.astream(inputs, config=config, stream_mode="values"):
         final_state = step
         print("\n--- Step Output ---")
         # Pretty print step keys and message types/content for clarity
@@ -546,3 +749,7 @@ if __name__ == "__main__":
     else:
         print("No final state or messages found.")
     print("--- Graph Execution Complete ---")
+
+
+if __name__ == "__main__":
+    asyncio.run(_run_example())
@@ -1,11 +1,39 @@
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
+from functools import cache
 
-# Primary LLM using Google's Gemini
-LLM = ChatGoogleGenerativeAI(model="gemini-2.0-flash-exp", temperature=0)
+from src.common.http import get_async_http_client, get_http_client, per_event_loop
 
-# Fallback LLM using OpenAI only if API key is available
-FALLBACK_LLM = None
-if os.getenv("OPENAI_API_KEY"):
-    FALLBACK_LLM = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+
+@cache
+def get_llm():
+    """Primary LLM using Google's Gemini, created on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash-exp", temperature=0)
+
+
+@cache
+def get_summary_llm():
+    """Gemini LLM with a short output limit, used to summarize older conversation history."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash-exp", temperature=0, max_output_tokens=200)
+
+
+@per_event_loop
+def get_fallback_llm():
+    """
+    Fallback LLM using OpenAI, created on first use only if an API key is available.
+    Built once per event loop so it can share that loop's async HTTP client.
+    """
+    if not os.getenv("OPENAI_API_KEY"):
+        return None
+
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model="gpt-4o-mini",
+        temperature=0,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
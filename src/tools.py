@@ -1,39 +1,102 @@
+import asyncio
+import heapq
 import logging
+import math
 import os
+import time
 import json
-import requests
+from collections import OrderedDict, defaultdict
+from functools import lru_cache, wraps
 from typing import Dict, Any
 
-from langchain_core.prompts import PromptTemplate
+import httpx
+import orjson
 from langchain_core.runnables import RunnableLambda
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool, tool
 from langchain_exa import ExaSearchRetriever
 from thirdweb_ai import Insight, Nebula
 from thirdweb_ai.adapters.langchain import get_langchain_tools
 
+from api.database import MongoDB
+from src.common.http import get_async_http_client, get_http_client
+
+
+def _tool_safe(name: str, default):
+    """
+    Logs any exception raised by the tool ``name`` and returns its default result instead.
+    ``default`` is either the value to return or a function building it from the exception.
+    """
+    def decorator(fn):
+        def on_error(e: Exception):
+            logging.error(f"Error in {name}: {e}")
+            return default(e) if callable(default) else default
+        
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    return on_error(e)
+        else:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    return on_error(e)
+        return wrapper
+    return decorator
+
+
+def _nebula_error(e: Exception) -> Dict[str, Any]:
+    return {"error": str(e)}
+
+
+def _error_result(e: Exception) -> Dict[str, Any]:
+    return {"error": str(e), "success": False}
+
+
+def _customer_error_result(e: Exception) -> Dict[str, Any]:
+    return {"error": str(e), "success": False, "customer_count": 0}
+
+
 # Initialize Insight for blockchain data retrieval
 insight = Insight(secret_key=os.getenv("THIRDWEB_SECRET_KEY"), chain_id=1)
-insight_tools = get_langchain_tools(insight.get_tools())
 # subset to tools I have tested
-insight_tools = [
-    tool
-    for tool in insight_tools
-    if tool.name
-    in [
-        "get_erc20_tokens",
-        "get_contract_metadata",
-        "get_erc721_tokens",
-        "get_token_prices",
-        "resolve",
-    ]
-]
+INSIGHT_TOOL_NAMES = frozenset({
+    "get_erc20_tokens",
+    "get_contract_metadata",
+    "get_erc721_tokens",
+    "get_token_prices",
+    "resolve",
+})
+# Only the tested tools are converted to LangChain tools
+insight_tools = get_langchain_tools(
+    [tool for tool in insight.get_tools() if tool.name in INSIGHT_TOOL_NAMES]
+)
 
 # Initialize Nebula for direct API access
 NEBULA_URL = "https://nebula-api.thirdweb.com/chat"
 SECRET_KEY = os.getenv("THIRDWEB_SECRET_KEY")
+NEBULA_HEADERS = {
+    "Content-Type": "application/json",
+    "x-secret-key": SECRET_KEY
+}
+NEBULA_TIMEOUT = httpx.Timeout(30.0, connect=3.0)
 
-@tool
-def call_nebula_api(message: str, execute: bool = False, user_id: str = "tool-user"):
+def _nebula_payload(message: str, execute: bool, user_id: str) -> Dict[str, Any]:
+    """Builds the request body for a Nebula chat call."""
+    return {
+        "message": message,
+        "user_id": user_id,
+        "stream": False,
+        "execute": execute
+    }
+
+
+@_tool_safe("call_nebula_api", _nebula_error)
+def _call_nebula_api(message: str, execute: bool = False, user_id: str = "tool-user"):
     """
     Send a message to Thirdweb's Nebula API and get blockchain-specific responses.
     
@@ -49,55 +112,72 @@ def call_nebula_api(message: str, execute: bool = False, user_id: str = "tool-us
     :param user_id: User identifier for the Nebula API
     :return: JSON response from the Nebula API containing assistant message and actions
     """
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "x-secret-key": SECRET_KEY
-        }
-        payload = {
-            "message": message,
-            "user_id": user_id,
-            "stream": False,
-            "execute": execute
-        }
-        resp = requests.post(NEBULA_URL, headers=headers, json=payload)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        logging.error(f"Error calling Nebula API: {e}")
-        return {"error": str(e)}
+    body = orjson.dumps(_nebula_payload(message, execute, user_id))
+    resp = get_http_client().post(NEBULA_URL, headers=NEBULA_HEADERS, content=body, timeout=NEBULA_TIMEOUT)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
+@_tool_safe("call_nebula_api", _nebula_error)
+async def _acall_nebula_api(message: str, execute: bool = False, user_id: str = "tool-user"):
+    """Async version of call_nebula_api, using the shared async HTTP client."""
+    body = orjson.dumps(_nebula_payload(message, execute, user_id))
+    resp = await get_async_http_client().post(NEBULA_URL, headers=NEBULA_HEADERS, content=body, timeout=NEBULA_TIMEOUT)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
+# Sync callers such as nebula_handler use invoke; the async graph awaits the coroutine
+call_nebula_api = StructuredTool.from_function(
+    func=_call_nebula_api, coroutine=_acall_nebula_api, name="call_nebula_api"
+)
 
 
 @tool
-def extract_json_value(json_data, key_path):
-    """Searches the web for relevant documents and extracts key highlights.
+async def batch_nebula(messages: list[str], user_id: str = "tool-user") -> list[Dict[str, Any]]:
+    """
+    Send several independent read-only queries to Thirdweb's Nebula API at once.
+    
+    Use this instead of calling call_nebula_api repeatedly when the queries don't depend
+    on each other's answers. Transactions are never executed.
+    
+    :param messages: The user queries about blockchain data
+    :param user_id: User identifier for the Nebula API
+    :return: The Nebula API responses, in the same order as the messages
+    """
+    return await asyncio.gather(*(_acall_nebula_api(message, False, user_id) for message in messages))
 
-    This function uses Exa Search to retrieve up to 3 relevant web pages and extracts useful metadata,
-    including key highlights and URLs. It is designed to help an AI assistant fetch real-time information.
 
-    Example usage:
-        - "What is the contract address of Ethereum?" → Returns a list of sources with relevant information.
-        - "Find recent news about AI in finance." → Retrieves web content with AI-related financial news.
+@lru_cache(maxsize=1024)
+def _compile_path(key_path: str) -> tuple[str, ...]:
+    """Splits a dotted key path into its keys, caching the result for repeated paths."""
+    return tuple(key_path.split("."))
+
+
+@tool
+@_tool_safe("extract_json_value", None)
+def extract_json_value(json_data, key_path):
+    """
+    Extracts the value at a given key path in a JSON object.
 
-    :param query: The search query describing the information needed.
-    :type query: str
-    :return: A list of formatted strings containing URLs and highlighted excerpts.
-    :rtype: list[str]
+    Example:
+    json_data = {"data": {"owner": {"address": "0x123..."}}}
+    extract_json_value(json_data, "data.owner.address")  # Returns "0x123..."
+
+    :param json_data: Dictionary representing JSON data.
+    :param key_path: String representing the nested key path (e.g., "data.owner.address").
+    :return: The value at the key path, or None if the path doesn't exist.
     """
-    try:
-        keys = key_path.split(".")
-        value = json_data
-        for key in keys:
-            value = value.get(key)
-            if value is None:
-                raise KeyError(f"Key '{key}' not found in JSON structure.")
-        return value
-    except Exception as e:
-        logging.error(f"Error extracting JSON value: {e}")
-        return None
+    value = json_data
+    for key in _compile_path(key_path):
+        value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            raise KeyError(f"Key '{key}' not found in JSON structure.")
+    return value
 
 
 @tool
+@_tool_safe("count_json_list", None)
 def count_json_list(json_data, key_path):
     """
     Counts the number of items in a list at a given key path in a JSON object.
@@ -110,66 +190,127 @@ def count_json_list(json_data, key_path):
     :param key_path: String representing the nested key path (e.g., "data.items").
     :return: Integer count of list items or None if the path is invalid.
     """
-    try:
-        # Split key path into list of keys
-        keys = key_path.split(".")
-        value = json_data
+    value = json_data
 
-        # Traverse the JSON using the keys
-        for key in keys:
-            if isinstance(value, dict) and key in value:
-                value = value[key]
-            else:
-                return None  # Return None if the key path doesn't exist or is invalid
+    # Traverse the JSON using the keys
+    for key in _compile_path(key_path):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            return None  # Return None if the key path doesn't exist or is invalid
 
-        # Check if the final value is a list and return the count
-        return len(value) if isinstance(value, list) else None
-    except Exception:
-        # In case of any error (though it should be rare), return None
-        return None
+    # Check if the final value is a list and return the count
+    return len(value) if isinstance(value, list) else None
 
 
-@tool
-def retrieve_web_content(query: str) -> list[str]:
-    """Function to retrieve usable documents for AI assistant
+def _format_documents(documents) -> list[str]:
+    """Formats Exa search results as source blocks with their URL and highlights."""
+    return [
+        f"""
+    <source>
+        <url>{document.metadata['url']}</url>
+        <highlights>{document.metadata.get('highlights', 'No highlights')}</highlights>
+    </source>
+    """
+        for document in documents
+    ]
 
-    You can for example find the address of a token by its ticker or name:
 
-    What is the token contract address of Ethereum? -> Returns the contract address of Ethereum token
-    """
+@lru_cache(maxsize=1)
+def _web_retrieval_chain():
+    """Builds the Exa retrieval chain on first use and reuses it for every query."""
     # Initialize the Exa Search retriever
     retriever = ExaSearchRetriever(
         k=3, highlights=True, exa_api_key=os.getenv("EXA_API_KEY"), use_autoprompt=True
     )
 
-    # Define how to extract relevant metadata from the search results
-    document_prompt = PromptTemplate.from_template(
-        """
-    <source>
-        <url>{url}</url>
-        <highlights>{highlights}</highlights>
-    </source>
-    """
-    )
+    # Format the retrieved documents directly instead of rendering a PromptTemplate per document
+    return retriever | RunnableLambda(_format_documents)
 
-    # Create a chain to process the retrieved documents
-    document_chain = (
-        RunnableLambda(
-            lambda document: {
-                "highlights": document.metadata.get("highlights", "No highlights"),
-                "url": document.metadata["url"],
-            }
-        )
-        | document_prompt
-    )
 
+def _retrieve_web_content(query: str) -> list[str]:
+    """Function to retrieve usable documents for AI assistant
+
+    You can for example find the address of a token by its ticker or name:
+
+    What is the token contract address of Ethereum? -> Returns the contract address of Ethereum token
+    """
     # Execute the retrieval and processing chain
-    retrieval_chain = retriever | document_chain.map()
+    return _web_retrieval_chain().invoke(query)
+
+
+async def _aretrieve_web_content(query: str) -> list[str]:
+    """Async version of retrieve_web_content."""
+    return await _web_retrieval_chain().ainvoke(query)
+
+
+retrieve_web_content = StructuredTool.from_function(
+    func=_retrieve_web_content, coroutine=_aretrieve_web_content, name="retrieve_web_content"
+)
+
+# Upper bound on the web searches a batch runs at the same time
+WEB_BATCH_CONCURRENCY = 8
+
+
+def _retrieve_web_content_batch(queries: list[str]) -> list[list[str]]:
+    """Function to retrieve usable documents for several independent queries at once
+
+    Use this instead of calling retrieve_web_content repeatedly, for example to find the
+    token contract addresses of several tokens:
+
+    What are the token contract addresses of Ethereum and USDT? -> Returns documents for each query, in order
+    """
+    if not queries:
+        return []
+    return _web_retrieval_chain().batch(queries, config={"max_concurrency": min(len(queries), WEB_BATCH_CONCURRENCY)})
+
+
+async def _aretrieve_web_content_batch(queries: list[str]) -> list[list[str]]:
+    """Async version of retrieve_web_content_batch."""
+    if not queries:
+        return []
+    return await _web_retrieval_chain().abatch(queries, config={"max_concurrency": min(len(queries), WEB_BATCH_CONCURRENCY)})
+
+
+retrieve_web_content_batch = StructuredTool.from_function(
+    func=_retrieve_web_content_batch, coroutine=_aretrieve_web_content_batch, name="retrieve_web_content_batch"
+)
+
+# Successful financial tool results are reused for TOOL_CACHE_TTL seconds, so repeated
+# calls in one reasoning chain don't query MongoDB again
+TOOL_CACHE_TTL = 30
+TOOL_CACHE_SIZE = 1024
+_tool_cache: "OrderedDict[tuple, tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+
+def _ttl_cached(fn):
+    """Caches the successful results of an async per-user tool, least recently used evicted first."""
+    @wraps(fn)
+    async def wrapper(user_id):
+        if not isinstance(user_id, str):
+            return await fn(user_id)
+        
+        key = (fn.__name__, user_id)
+        now = time.monotonic()
+        entry = _tool_cache.get(key)
+        if entry is not None and entry[0] > now:
+            _tool_cache.move_to_end(key)
+            return entry[1]
+        
+        result = await fn(user_id)
+        if result.get("success"):
+            _tool_cache[key] = (now + TOOL_CACHE_TTL, result)
+            _tool_cache.move_to_end(key)
+            if len(_tool_cache) > TOOL_CACHE_SIZE:
+                _tool_cache.popitem(last=False)
+        return result
+    return wrapper
 
-    return retrieval_chain.invoke(query)
 
 @tool
-def get_financial_data(user_id: str) -> Dict[str, Any]:
+@_ttl_cached
+@_tool_safe("get_financial_data", _error_result)
+async def get_financial_data(user_id: str) -> Dict[str, Any]:
     """
     Retrieve financial data for a specific user including contacts, expenses, products, and transactions.
     
@@ -186,39 +327,22 @@ def get_financial_data(user_id: str) -> Dict[str, Any]:
     if isinstance(user_id, dict):
         user_id = user_id.get("user_id", "default_user")
     
-    import asyncio
-    from api.database import MongoDB
+    # Initialize MongoDB connection if not already initialized
+    if not await MongoDB.ensure_connected():
+        return _error_result(ConnectionError("Could not connect to MongoDB"))
     
-    async def _get_data():
-        # Initialize MongoDB connection if not already initialized
-        try:
-            if MongoDB.db is None:
-                await MongoDB.connect()
-            
-            # Retrieve financial data from MongoDB
-            contacts = await MongoDB.get_contacts(user_id)
-            expenses = await MongoDB.get_expenses(user_id)
-            products = await MongoDB.get_products(user_id)
-            transactions = await MongoDB.get_transactions(user_id)
-            
-            return {
-                "contacts": contacts,
-                "expenses": expenses,
-                "products": products,
-                "transactions": transactions,
-                "success": True
-            }
-        except Exception as e:
-            logging.error(f"Error retrieving financial data: {str(e)}")
-            return {
-                "error": str(e),
-                "success": False
-            }
+    # Retrieve financial data from MongoDB
+    data = await MongoDB.get_all_user_data(user_id)
     
-    return asyncio.run(_get_data())
+    return {
+        **data,
+        "success": True
+    }
 
 @tool
-def analyze_expenses(user_id: str) -> Dict[str, Any]:
+@_ttl_cached
+@_tool_safe("analyze_expenses", _error_result)
+async def analyze_expenses(user_id: str) -> Dict[str, Any]:
     """
     Analyze a user's expenses to identify patterns, categories, and trends.
     
@@ -235,60 +359,31 @@ def analyze_expenses(user_id: str) -> Dict[str, Any]:
     if isinstance(user_id, dict):
         user_id = user_id.get("user_id", "default_user")
     
-    import asyncio
-    from api.database import MongoDB
+    # Initialize MongoDB connection if not already initialized
+    if not await MongoDB.ensure_connected():
+        return _error_result(ConnectionError("Could not connect to MongoDB"))
+    
+    # Total the expenses per category in MongoDB, sorted by amount
+    categories = await MongoDB.aggregate_expenses(user_id)
     
-    async def _analyze():
-        # Initialize MongoDB connection if not already initialized
-        try:
-            if MongoDB.db is None:
-                await MongoDB.connect()
-            
-            # Retrieve expense data from MongoDB
-            expenses = await MongoDB.get_expenses(user_id)
-            
-            if not expenses:
-                return {
-                    "error": "No expense data found for this user",
-                    "success": False
-                }
-            
-            # Perform basic analysis
-            total_expenses = sum(expense.get("amount", 0) for expense in expenses)
-            expense_categories = {}
-            
-            for expense in expenses:
-                category = expense.get("category", "Uncategorized")
-                amount = expense.get("amount", 0)
-                if category in expense_categories:
-                    expense_categories[category] += amount
-                else:
-                    expense_categories[category] = amount
-            
-            # Sort categories by amount
-            sorted_categories = sorted(
-                expense_categories.items(), 
-                key=lambda x: x[1], 
-                reverse=True
-            )
-            
-            return {
-                "total_expenses": total_expenses,
-                "expense_categories": dict(sorted_categories),
-                "expense_count": len(expenses),
-                "success": True
-            }
-        except Exception as e:
-            logging.error(f"Error analyzing expenses: {str(e)}")
-            return {
-                "error": str(e),
-                "success": False
-            }
+    if not categories:
+        return {
+            "error": "No expense data found for this user",
+            "success": False
+        }
     
-    return asyncio.run(_analyze())
+    return {
+        # fsum keeps the total exact across many fractional category totals
+        "total_expenses": math.fsum(category["total"] for category in categories),
+        "expense_categories": {category["_id"]: category["total"] for category in categories},
+        "expense_count": sum(category["count"] for category in categories),
+        "success": True
+    }
 
 @tool
-def get_customer_insights(user_id: str) -> Dict[str, Any]:
+@_ttl_cached
+@_tool_safe("get_customer_insights", _customer_error_result)
+async def get_customer_insights(user_id: str) -> Dict[str, Any]:
     """
     Analyze customer relationships and transaction patterns.
     
@@ -305,77 +400,104 @@ def get_customer_insights(user_id: str) -> Dict[str, Any]:
     if isinstance(user_id, dict):
         user_id = user_id.get("user_id", "default_user")
     
-    import asyncio
-    from api.database import MongoDB
+    # Initialize MongoDB connection if not already initialized
+    if not await MongoDB.ensure_connected():
+        return _customer_error_result(ConnectionError("Could not connect to MongoDB"))
+    
+    # Retrieve customer and transaction data from MongoDB concurrently
+    contacts, transactions = await asyncio.gather(
+        MongoDB.get_contacts(user_id),
+        MongoDB.get_transactions(user_id)
+    )
+    
+    if not contacts:
+        return {
+            "error": "No contact data found for this user",
+            "success": False,
+            "customer_count": 0
+        }
+    
+    # Index contacts by id so transactions can be matched in one pass
+    contacts_by_id = {contact.get("_id") or contact.get("id"): contact for contact in contacts}
+    
+    # Accumulate [total, count] per known contact in a single scan of the transactions
+    totals = defaultdict(lambda: [0, 0])
+    
+    for transaction in transactions:
+        contact_id = transaction.get("contactId")
+        if contact_id not in contacts_by_id:
+            continue
+        
+        entry = totals[contact_id]
+        entry[0] += transaction.get("amount", 0)
+        entry[1] += 1
+    
+    # Keep the top 10 customers by transaction total without sorting them all
+    top_ten = heapq.nlargest(10, totals.items(), key=lambda item: item[1][0])
+    top_customers = [
+        {
+            "contact": contacts_by_id[contact_id],
+            "total_value": total,
+            "transaction_count": count
+        }
+        for contact_id, (total, count) in top_ten
+    ]
     
-    async def _analyze():
-        # Initialize MongoDB connection if not already initialized
-        try:
-            if MongoDB.db is None:
-                await MongoDB.connect()
-            
-            # Retrieve customer and transaction data from MongoDB
-            contacts = await MongoDB.get_contacts(user_id)
-            transactions = await MongoDB.get_transactions(user_id)
-            
-            if not contacts:
-                return {
-                    "error": "No contact data found for this user",
-                    "success": False,
-                    "customer_count": 0
-                }
-            
-            # Map transactions to contacts
-            customer_transactions = {}
-            
-            for transaction in transactions:
-                contact_id = transaction.get("contactId")
-                if not contact_id:
-                    continue
-                
-                amount = transaction.get("amount", 0)
-                if contact_id in customer_transactions:
-                    customer_transactions[contact_id]["total"] += amount
-                    customer_transactions[contact_id]["transactions"].append(transaction)
-                else:
-                    customer_transactions[contact_id] = {
-                        "total": amount,
-                        "transactions": [transaction]
-                    }
-            
-            # Add contact details
-            for contact in contacts:
-                contact_id = contact.get("_id") or contact.get("id")
-                if contact_id in customer_transactions:
-                    customer_transactions[contact_id]["contact"] = contact
-            
-            # Sort customers by transaction total
-            top_customers = sorted(
-                [
-                    {
-                        "contact": data.get("contact", {}),
-                        "total_value": data["total"],
-                        "transaction_count": len(data["transactions"])
-                    }
-                    for contact_id, data in customer_transactions.items()
-                    if "contact" in data
-                ],
-                key=lambda x: x["total_value"],
-                reverse=True
-            )[:10]  # Get top 10
-            
-            return {
-                "top_customers": top_customers,
-                "customer_count": len(contacts),
-                "transaction_count": len(transactions),
-                "success": True
-            }
-        except Exception as e:
-            logging.error(f"Error analyzing customer data: {str(e)}")
-            return {
-                "error": str(e),
-                "success": False,
-                "customer_count": 0
-            }
+    return {
+        "top_customers": top_customers,
+        "customer_count": len(contacts),
+        "transaction_count": len(transactions),
+        "success": True
+    }
+
+
+@tool
+async def blockchain_and_web(message: str, query: str) -> Dict[str, Any]:
+    """
+    Query Thirdweb's Nebula API and search the web at the same time.
+    
+    Use this when a question needs both blockchain data and web content, and the
+    web search doesn't depend on the Nebula answer (or the other way around).
+    Transactions are never executed.
     
-    return asyncio.run(_analyze())
+    :param message: The user query about blockchain data for the Nebula API
+    :param query: The search query describing the web information needed
+    :return: A dictionary with the Nebula response under "nebula" and the web results under "web"
+    """
+    nebula, web = await asyncio.gather(
+        _acall_nebula_api(message),
+        _aretrieve_web_content(query),
+        return_exceptions=True
+    )
+    if isinstance(web, Exception):
+        logging.error(f"Error retrieving web content: {web}")
+        web = {"error": str(web)}
+    return {"nebula": nebula, "web": web}
+
+
+@tool
+async def full_dashboard(user_id: str) -> Dict[str, Any]:
+    """
+    Retrieve a user's financial data, expense analysis and customer insights in one call.
+    
+    Use this when a question needs an overview across all financial data, instead of
+    calling get_financial_data, analyze_expenses and get_customer_insights separately.
+    
+    Args:
+        user_id: The unique identifier of the user
+        
+    Returns:
+        A dictionary with the results of the three financial tools
+    """
+    # The three tools run concurrently, so their reads of the same collections are batched together
+    financial_data, expenses, customers = await asyncio.gather(
+        get_financial_data.coroutine(user_id),
+        analyze_expenses.coroutine(user_id),
+        get_customer_insights.coroutine(user_id)
+    )
+    return {
+        "financial_data": financial_data,
+        "expense_analysis": expenses,
+        "customer_insights": customers,
+        "success": all(result.get("success") for result in (financial_data, expenses, customers))
+    }
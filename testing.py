@@ -1,42 +1,59 @@
 import os
 from nebula import Nebula
-from typing import Optional
+from typing import Iterator, Optional
+
+# Shared by every NebulaClient so instances reuse one client and its connections
+_NEBULA = Nebula(
+    base_url=os.getenv("NEBULA_BASE_URL", "https://nebula-api.thirdweb.com"),
+    secret_key=os.getenv("THIRDWEB_SECRET_KEY")
+)
 
 class NebulaClient:
     def __init__(self):
-        self.client = Nebula(
-            base_url=os.getenv("NEBULA_BASE_URL", "https://nebula-api.thirdweb.com"),
-            secret_key=os.getenv("THIRDWEB_SECRET_KEY")
-        )
+        self.client = _NEBULA
+
+    @staticmethod
+    def _invoice_message(amount_eth: float, to_address: str, invoice_id: str) -> str:
+        return f"Pay {amount_eth} ETH to {to_address} for Invoice #{invoice_id}"
 
     def pay_invoice(
         self,
         user_id: str,
         amount_eth: float,
         to_address: str,
-        invoice_id: str,
-        stream: bool = False
+        invoice_id: str
     ) -> Optional[str]:
         """
         Sends a payment instruction to Nebula and returns the transaction hash.
-        If `stream=True`, yields incremental response chunks.
+        Use `pay_invoice_stream` to receive incremental response chunks instead.
         """
-        message = (
-            f"Pay {amount_eth} ETH to {to_address} for Invoice #{invoice_id}"
-        )
         # Non-streaming chat+execute call
         response = self.client.chat(
-            message=message,
+            message=self._invoice_message(amount_eth, to_address, invoice_id),
             user_id=user_id,
-            stream=stream,
+            stream=False,
             execute=True
         )
-        # If streaming, return generator of chunks
-        if stream:
-            for chunk in response:
-                yield chunk
-            return None
 
-        # response.message is the LLM’s text; response.action holds the TX data
-        tx_hash = getattr(response.action, "tx_hash", None)
-        return tx_hash
+        # response.message is the LLM’s text; response.action holds the TX data,
+        # and is None when Nebula didn't execute a transaction
+        action = response.action
+        return action.tx_hash if action is not None else None
+
+    def pay_invoice_stream(
+        self,
+        user_id: str,
+        amount_eth: float,
+        to_address: str,
+        invoice_id: str
+    ) -> Iterator[str]:
+        """
+        Sends a payment instruction to Nebula and yields the response chunks
+        as they arrive.
+        """
+        yield from self.client.chat(
+            message=self._invoice_message(amount_eth, to_address, invoice_id),
+            user_id=user_id,
+            stream=True,
+            execute=True
+        )